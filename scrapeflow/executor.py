@@ -1,8 +1,13 @@
 """Main executor module for parallel workflow processing."""
 
+import asyncio
+import contextlib
 import functools
-from asyncio import CancelledError, Semaphore, wait_for
+import logging
+import re
+from asyncio import CancelledError, Queue, wait_for
 from asyncio import TimeoutError as TOError
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
 from typing import (
@@ -21,13 +26,24 @@ import aiohttp
 import PIL
 import tqdm.asyncio
 
+from scrapeflow.memo import memo_key, read_memo, upstream_hashes, write_memo
 from scrapeflow.proxies import ProxyProvider
-from scrapeflow.status import Params, StatusData, read_one_status, write_one_status
+from scrapeflow.status import (
+    Params,
+    StatusData,
+    dumps_status,
+    read_one_status_async,
+    write_one_status_bytes,
+)
 
 # Either we return a response or raise an Exception. The second bool tells
 # us whether we ran (True) or was skipped.
 ExecutorResponse = Tuple[StatusData, bool]
 Executor = Callable[["Context", StatusData], Awaitable[ExecutorResponse]]
+# Status files waiting to be written by _status_writer, None stops the writer.
+StatusQueue = Queue[Optional[Tuple[Path, str, bytes]]]
+
+log = logging.getLogger(__name__)
 
 # Some sites return 406 with the default user agent.
 _USER_AGENT = (
@@ -35,11 +51,95 @@ _USER_AGENT = (
     + "(KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
 )
 _ASYNC_TIMEOUT_SECONDS = 30
-# There is an internal limitation within aiohttp on the max number of
-# parallel requests (100) (cf.
-# https://stackoverflow.com/questions/55259755/maximize-number-of-parallel-requests-aiohttp).
-# We also need to limit this to avoid too many open files.
+# The default aiohttp connector caps the number of parallel requests at 100 (cf.
+# https://stackoverflow.com/questions/55259755/maximize-number-of-parallel-requests-aiohttp),
+# so we build our own connector sized to max_parallelism. We still need to limit this to
+# avoid too many open files.
 _MAX_PARALLELISM = 100
+# Cache DNS lookups and keep idle connections around so that consecutive requests to the
+# same host reuse the socket.
+_DNS_CACHE_TTL_SECONDS = 300
+_KEEPALIVE_TIMEOUT_SECONDS = 75
+# Keys are used as file names: no slashes and not "." or "..".
+_KEY_RE = re.compile(r"(?!\.\.?\Z)[^/]+")
+_MAX_ERROR_MESSAGE_LENGTH = 512
+# Errors that fail the task (and are saved in its status) without stopping the others.
+_RECOGNIZED = (
+    PIL.UnidentifiedImageError,
+    aiohttp.InvalidURL,
+    aioftp.errors.StatusCodeError,
+    aiohttp.ClientConnectorError,
+    aiohttp.ServerDisconnectedError,
+    aiohttp.ClientOSError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    aiohttp.ClientResponseError,
+    TOError,
+    # Our own exceptions for signalling task errors.
+    RuntimeError,
+)
+
+
+def _default_limit_per_host(max_parallelism: int) -> int:
+    # A lower per-host limit is politer to (and less likely to get banned by) a single
+    # site, but throttles workloads that mostly hit the same host.
+    return max(10, max_parallelism // 4)
+
+
+def _new_session(connection_limit: int, limit_per_host: int) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=connection_limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=_DNS_CACHE_TTL_SECONDS,
+        use_dns_cache=True,
+        enable_cleanup_closed=True,
+        keepalive_timeout=_KEEPALIVE_TIMEOUT_SECONDS,
+    )
+    return aiohttp.ClientSession(
+        connector=connector, headers={"User-Agent": _USER_AGENT}
+    )
+
+
+class SessionManager:
+    """Reuses aiohttp sessions across execute_async calls on the same event loop.
+
+    Reusing a session keeps the connection pool, the DNS cache and the TLS sessions
+    alive between batches. There is one session per connector limits, and all of them
+    are closed when leaving the context:
+
+        async with SessionManager() as sessions:
+            for batch in batches:
+                await execute_async(..., session=await sessions.get())
+    """
+
+    def __init__(self) -> None:
+        self._sessions: dict[Tuple[int, int], aiohttp.ClientSession] = {}
+
+    async def get(
+        self,
+        connection_limit: int = _MAX_PARALLELISM,
+        limit_per_host: Optional[int] = None,
+    ) -> aiohttp.ClientSession:
+        if limit_per_host is None:
+            limit_per_host = _default_limit_per_host(connection_limit)
+        limits = (connection_limit, limit_per_host)
+        session = self._sessions.get(limits)
+        if session is None or session.closed:
+            session = _new_session(connection_limit, limit_per_host)
+            self._sessions[limits] = session
+        return session
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    async def __aenter__(self) -> "SessionManager":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
 
 
 class Context(NamedTuple):
@@ -48,16 +148,21 @@ class Context(NamedTuple):
     dir: Path
     # To be used for async http requests.
     session: Optional[aiohttp.ClientSession]
-    # List of executor names that need to be forced or 'all'
-    force_executors: list[Executor] | Literal["all"]
-    # Limit concurrency with semaphore
-    semaphore: Semaphore
+    # Set of executor names that need to be forced or 'all'
+    force_executor_names: frozenset[str] | Literal["all"]
     # Timeout
     timeout_seconds: float
     # Proxy provider for http requests
     proxy_provider: Optional[ProxyProvider]
     # Use-case specific contextual params
     params: StatusData
+    # Directory of memoized executor outputs shared across keys (and runs), if any
+    memo_dir: Optional[Path] = None
+
+
+def _is_forced(phase: str, context: Context) -> bool:
+    forced = context.force_executor_names
+    return forced == "all" or phase in forced
 
 
 # Returns if this phase needs to run.
@@ -68,113 +173,223 @@ def previous_execution(
     if phase not in task_status:
         return None
     # This phase or all phases are forced.
-    forced_executor_names = (
-        [f.__name__ for f in context.force_executors]
-        if context.force_executors != "all"
-        else []
-    )
-    if phase in forced_executor_names or context.force_executors == "all":
+    if _is_forced(phase, context):
         return None
     # Return the task status for the previous executor.
     return task_status[phase]
 
 
-def taskify(func):
-    """Wraps a function to check previous exectution and only run if not awailable."""
+class _TaskExecutor:
+    """Executor wrapping func, skipping it if it has already run and is not forced.
+
+    The status keys of the executor are computed once here instead of for every task.
+    """
+
+    # __dict__ keeps the rest of the metadata of func (__doc__, __module__, ...), the
+    # class defines those itself so they can't be slots.
+    __slots__ = (
+        "__dict__",
+        "_func",
+        "__name__",
+        "__qualname__",
+        "__wrapped__",
+        "status_key",
+        "last_run_key",
+        "error_msg_key",
+        "_memo_files",
+    )
+
+    def __init__(self, func) -> None:
+        self._func = func
+        functools.update_wrapper(self, func)
+        self.status_key = f"{func.__name__}_status"
+        self.last_run_key = f"{func.__name__}_last_run"
+        self.error_msg_key = f"{func.__name__}_error_msg"
+        # Only executors reporting the files they write can be memoized.
+        self._memo_files = getattr(func, "memo_files", None)
 
-    @functools.wraps(func)
-    async def wrapper(
-        context: Context, key: str, task_status: StatusData, *args
+    def __repr__(self) -> str:
+        return f"<executor {self.__qualname__}>"
+
+    async def __call__(
+        self, context: Context, key: str, task_status: StatusData, *args
     ) -> ExecutorResponse:
+        name = self.__name__
         # Skip this phase if it has already run and is not forced.
-        prev_run = previous_execution(
-            func.__name__,
-            context,
-            task_status,
-        )
-        # print("prev_run", func.__name__, prev_run)
+        prev_run = previous_execution(name, context, task_status)
         if prev_run is not None:
-            return prev_run, False  # type:ignore
-        response_status = await func(context, key, task_status, *args)
+            return prev_run, False
+        if context.memo_dir is None or self._memo_files is None:
+            response_status = await self._func(context, key, task_status, *args)
+            return response_status, True
+
+        # Reuse the output of an equivalent execution, possibly under a different key.
+        mkey = memo_key(
+            name,
+            task_status.get("params"),
+            context.params,
+            upstream_hashes(name, task_status),
+        )
+        file_names = self._memo_files(context, key, task_status)
+        # Forced executors always run, their fresh output replaces the memoized one.
+        if not _is_forced(name, context):
+            memo = await asyncio.to_thread(
+                read_memo, context.memo_dir, mkey, file_names
+            )
+            if memo is not None:
+                return memo, False
+        response_status = await self._func(context, key, task_status, *args)
+        await asyncio.to_thread(
+            write_memo, context.memo_dir, mkey, response_status, file_names
+        )
         return response_status, True
 
-    return wrapper
+
+def taskify(func) -> _TaskExecutor:
+    """Wraps a function to check previous exectution and only run if not awailable."""
+    return _TaskExecutor(func)
+
+
+# An executor with its task name, status key, last run key and error message key.
+_ChainLink = Tuple[Executor, str, str, str, str]
+
+
+def _chain_link(executor: Executor) -> _ChainLink:
+    if isinstance(executor, _TaskExecutor):
+        return (
+            executor,
+            executor.__name__,
+            executor.status_key,
+            executor.last_run_key,
+            executor.error_msg_key,
+        )
+    task = executor.__name__
+    return executor, task, f"{task}_status", f"{task}_last_run", f"{task}_error_msg"
+
+
+def _record_error(
+    status: StatusData, link: _ChainLink, key: str, params: Params, e: BaseException
+) -> None:
+    _, task, status_key, last_run_key, error_msg_key = link
+    # Lazy formatting: params are only turned into a string if the log is emitted.
+    log.error("ERROR: %s %s %s %s", task, key, params, e.__class__.__name__)
+    # Keep the status short and stable so that it aggregates well in status_summary,
+    # the (potentially long) message is stored separately.
+    status[status_key] = f"ERROR {e.__class__.__name__}"
+    status[error_msg_key] = str(e)[:_MAX_ERROR_MESSAGE_LENGTH]
+    status[last_run_key] = str(datetime.now())
+    status.pop(task, None)
 
 
 async def _execute_single_chain_async(
-    context: Context, executors: Sequence[Executor], key: str, params: Params, timeout
+    context: Context,
+    chain: Sequence[_ChainLink],
+    key: str,
+    params: Params,
+    timeout,
+    status_queue: StatusQueue,
 ) -> str:
-    async with context.semaphore:
-        status: StatusData = read_one_status(context.dir, key) or {"params": params}
-
-        recognized_exception = None
-        for executor in executors:
-            task = executor.__name__
-            status_key = f"{task}_status"
-            last_run_key = f"{task}_last_run"
-            did_run = False
-            try:
-                response_status, did_run = await wait_for(
-                    executor(context, key, status), timeout  # type: ignore
-                )  # type: ignore
-                # Successfully completed.
-                status[task] = response_status
-                if did_run:
-                    status[status_key] = "SUCCESS"
-                    status[last_run_key] = str(datetime.now())
-                else:
-                    # TODO(zt): remove
-                    status[status_key] = "SUCCESS"
-            # Certain types of errors / exceptions we save in status.
-            except PIL.UnidentifiedImageError as e:
-                recognized_exception = e
-            except aiohttp.InvalidURL as e:
-                recognized_exception = e
-            except aioftp.errors.StatusCodeError as e:
-                recognized_exception = e
-            except aiohttp.ClientConnectorError as e:
-                recognized_exception = e
-            except aiohttp.ServerDisconnectedError as e:
-                recognized_exception = e
-            except aiohttp.ClientOSError as e:
-                recognized_exception = e
-            except aiohttp.ClientConnectionError as e:
-                recognized_exception = e
-            except aiohttp.ClientPayloadError as e:
-                recognized_exception = e
-            except aiohttp.ClientResponseError as e:
-                recognized_exception = e
-            except TOError as e:
-                recognized_exception = e
-            except CancelledError as e:
-                recognized_exception = TOError(e)
-            except RuntimeError as e:
-                # Our own exceptions for signalling task errors.
-                recognized_exception = e
-            except Exception as e:
-                write_one_status(context.dir, key, status)
-                raise e
-
-            if recognized_exception:
-                print(
-                    f"ERROR: {task} {key} {params} "
-                    f"{recognized_exception.__class__.__name__}"
-                )
-                status[status_key] = (
-                    f"ERROR {recognized_exception.__class__.__name__}::"
-                    + f"{recognized_exception}"
-                )
+    previous_status = await read_one_status_async(context.dir, key)
+    status: StatusData = previous_status or {"params": params}
+
+    for link in chain:
+        executor, task, status_key, last_run_key, error_msg_key = link
+        did_run = False
+        try:
+            response_status, did_run = await wait_for(
+                executor(context, key, status), timeout  # type: ignore
+            )  # type: ignore
+            # Successfully completed.
+            status[task] = response_status
+            status.pop(error_msg_key, None)
+            if did_run:
+                status[status_key] = "SUCCESS"
                 status[last_run_key] = str(datetime.now())
-                if task in status:
-                    del status[task]
-                break
+            else:
+                # TODO(zt): remove
+                status[status_key] = "SUCCESS"
+        # Certain types of errors / exceptions we save in status.
+        except _RECOGNIZED as e:
+            _record_error(status, link, key, params, e)
+            break
+        except CancelledError as e:
+            # Keep the interrupted task's status, but let the worker stop.
+            _record_error(status, link, key, params, TOError(e))
+            _queue_status(status_queue, context, key, status)
+            raise e
+        except Exception as e:
+            _queue_status(status_queue, context, key, status)
+            raise e
+
+    _queue_status(status_queue, context, key, status)
+    return key
+
+
+def _queue_status(
+    status_queue: StatusQueue, context: Context, key: str, status: StatusData
+) -> None:
+    # Serialized here, so that a status that can't be serialized fails its own task
+    # instead of the writer.
+    status_queue.put_nowait((context.dir, key, dumps_status(status)))
+
+
+def _write_statuses(batch: list[Tuple[Path, str, bytes]]) -> None:
+    for directory, key, data in batch:
+        # One failing file shouldn't keep the rest of the batch from being written.
+        try:
+            write_one_status_bytes(directory, key, data)
+        except Exception:
+            log.exception("Failed to write the status of %s", key)
+
+
+async def _status_writer(status_queue: StatusQueue) -> None:
+    """Writes the queued status files in batches on a thread, until it gets None."""
+    while True:
+        batch = [await status_queue.get()]
+        while not status_queue.empty():
+            batch.append(status_queue.get_nowait())
+        statuses = [item for item in batch if item is not None]
+        if statuses:
+            await asyncio.to_thread(_write_statuses, statuses)
+        if len(statuses) < len(batch):
+            return
 
-        write_one_status(context.dir, key, status)
-        return key
+
+async def _produce(
+    queue: Queue[Optional[Tuple[int, str, Params]]],
+    tasks: dict[str, Params] | Sequence[str],
+    num_workers: int,
+) -> None:
+    items = tasks.items() if isinstance(tasks, dict) else ((key, {}) for key in tasks)
+    for index, (key, params) in enumerate(items):
+        await queue.put((index, key, params))
+    # One sentinel per worker to shut them down.
+    for _ in range(num_workers):
+        await queue.put(None)
+
+
+async def _worker(
+    queue: Queue[Optional[Tuple[int, str, Params]]],
+    context: Context,
+    chain: Sequence[_ChainLink],
+    timeout: float,
+    status_queue: StatusQueue,
+    ret: list[str],
+    pbar: tqdm.asyncio.tqdm,
+) -> None:
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        index, key, params = item
+        ret[index] = await _execute_single_chain_async(
+            context, chain, key, params, timeout, status_queue
+        )
+        pbar.update(1)
 
 
 def _is_valid_filename(filename: str) -> bool:
-    return filename not in [".", ".."] and not filename.count("/") > 0
+    return _KEY_RE.fullmatch(filename) is not None
 
 
 async def execute_async(
@@ -187,17 +402,22 @@ async def execute_async(
     max_parallelism: Optional[int] = None,
     proxy_provider: Optional[ProxyProvider] = None,
     context_params: Optional[StatusData] = None,
+    connection_limit: Optional[int] = None,
+    limit_per_host: Optional[int] = None,
+    session: Optional[aiohttp.ClientSession] = None,
+    memo_dir: Optional[Path] = None,
 ) -> list[str] | None:
     # validate keys in tasks as it is used as a directory name
     all_keys = list(tasks.keys() if isinstance(tasks, dict) else tasks)
     # check for duplicate keys
-    if len(set(all_keys)) != len(all_keys):
-        duplicate_keys = [key for key in all_keys if all_keys.count(key) > 1]
+    key_counts = Counter(all_keys)
+    if len(key_counts) != len(all_keys):
+        duplicate_keys = [key for key, count in key_counts.items() if count > 1]
         raise ValueError(f"Duplicate keys: {duplicate_keys}")
 
-    for key in all_keys:
-        if not _is_valid_filename(key):
-            raise ValueError(f"Invalid key: {key}")
+    invalid_key = next((key for key in all_keys if not _is_valid_filename(key)), None)
+    if invalid_key is not None:
+        raise ValueError(f"Invalid key: {invalid_key}")
 
     directory.mkdir(parents=True, exist_ok=True)
 
@@ -207,29 +427,71 @@ async def execute_async(
     if max_parallelism is None:
         max_parallelism = _MAX_PARALLELISM
 
-    async with aiohttp.ClientSession(headers={"User-Agent": _USER_AGENT}) as session:
+    # The connector should never be tighter than the number of workers, otherwise
+    # requests queue up silently inside aiohttp.
+    if connection_limit is None:
+        connection_limit = max_parallelism
+
+    if limit_per_host is None:
+        limit_per_host = _default_limit_per_host(max_parallelism)
+
+    # Without a session from the caller, we use one for this call only.
+    async with contextlib.AsyncExitStack() as stack:
+        if session is None:
+            session = await stack.enter_async_context(
+                _new_session(connection_limit, limit_per_host)
+            )
+        force_executor_names: frozenset[str] | Literal["all"] = (
+            "all"
+            if force_executors == "all"
+            else frozenset(f.__name__ for f in force_executors or [])
+        )
         context = Context(
             directory,
             session,
-            force_executors=force_executors or [],
-            semaphore=Semaphore(max_parallelism),
+            force_executor_names=force_executor_names,
             timeout_seconds=timeout,
             proxy_provider=proxy_provider,
             params=context_params or {},
+            memo_dir=memo_dir,
         )
-        try:
-            ret = await tqdm.asyncio.tqdm.gather(
-                *[
-                    _execute_single_chain_async(
-                        context, executors, key, params, timeout
-                    )
-                    for key, params in (
-                        tasks if isinstance(tasks, dict) else {key: {} for key in tasks}
-                    ).items()
-                ]
-            )
-        except CancelledError:
-            return None
-        except KeyboardInterrupt:
-            return None
-    return ret
+        chain = [_chain_link(executor) for executor in executors]
+        # A fixed pool of workers pulls the tasks from a bounded queue, so that only
+        # O(max_parallelism) coroutines exist at any time instead of one per task.
+        queue: Queue[Optional[Tuple[int, str, Params]]] = Queue(
+            maxsize=max_parallelism * 2
+        )
+        ret: list[str] = [""] * len(all_keys)
+        num_workers = min(max_parallelism, len(all_keys))
+        # Status files are written by a single background writer, off the event loop.
+        status_queue: StatusQueue = Queue()
+        status_writer = asyncio.create_task(_status_writer(status_queue))
+        with tqdm.asyncio.tqdm(total=len(all_keys)) as pbar:
+            workers = [
+                asyncio.create_task(
+                    _worker(queue, context, chain, timeout, status_queue, ret, pbar)
+                )
+                for _ in range(num_workers)
+            ]
+            producer = asyncio.create_task(_produce(queue, tasks, num_workers))
+            try:
+                await asyncio.gather(producer, *workers)
+            except CancelledError:
+                return None
+            except KeyboardInterrupt:
+                return None
+            finally:
+                # Stop feeding the workers and wait for their in-flight tasks (the
+                # cancelled ones record a timeout and stop), so that every status is
+                # queued before the writer is stopped.
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+                while not queue.empty():
+                    queue.get_nowait()
+                for _ in workers:
+                    queue.put_nowait(None)
+                await asyncio.gather(*workers, return_exceptions=True)
+                # Flush the pending status files.
+                status_queue.put_nowait(None)
+                await status_writer
+        return ret
@@ -1,106 +1,205 @@
 #!/usr/bin/env python
 
-import errno
-import hashlib
+import asyncio
+import mmap
 import os
+from fractions import Fraction
+from pathlib import Path
+from typing import Optional
 
 import pandas as pd
 from PIL import Image
 
 from scrapeflow.executor import Context, taskify
+from scrapeflow.memo import symlink_force
 from scrapeflow.scrape import ScraperResponse, scrapify
-from scrapeflow.status import MetaData, read_metadata
+from scrapeflow.status import StatusData, new_hasher, read_status
 
+# Pillow can be replaced by pillow-simd (same API) for faster resizing. When PyTurboJPEG
+# (and libjpeg-turbo) is installed we use it to decode JPEGs at a reduced scale.
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG
+
+    _turbo_jpeg: Optional[TurboJPEG] = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbo_jpeg = None
+
+# The decoding / hashing below is blocking, CPU heavy work, so the executors run it in
+# a thread to keep the event loop (and the other tasks' requests) going.
 
-@taskify
-async def parse_image(context: Context, meta: MetaData) -> MetaData:
-    response_meta = {}
-    name = meta["name"]
-    image_file_name = f"{context.dir}/{name}.scrape"
 
+def _parse_image(image_file_name: Path) -> StatusData:
+    response_meta = {}
     with Image.open(image_file_name) as img:
         response_meta["format"] = img.format
         response_meta["width"] = img.size[0]
         response_meta["height"] = img.size[1]
-
     return response_meta
 
 
-@taskify
-async def thumbnail(context: Context, meta: MetaData) -> MetaData:
+def _thumbnail(image_file_name: Path, thumbnail_file_name: Path, size) -> StatusData:
     response_meta = {}
-    name = meta["name"]
-    image_file_name = f"{context.dir}/{name}.scrape"
-
     with Image.open(image_file_name) as img:
-        img.thumbnail(context.params["thumbnail"])
-        img.save(f"{context.dir}/{name}.thumb.webp")
+        img.thumbnail(size)
+        img.save(thumbnail_file_name)
         response_meta["format"] = "WEBP"
         response_meta["width"] = img.size[0]
         response_meta["height"] = img.size[1]
+    return response_meta
+
+
+def _nearest_scaling_for(width: int, height: int, size) -> tuple[int, int]:
+    """The smallest TurboJPEG scaling factor that keeps the thumbnail size."""
+    assert _turbo_jpeg is not None
+    ratio = min(Fraction(size[0], width), Fraction(size[1], height), Fraction(1))
+    return min(
+        (f for f in _turbo_jpeg.scaling_factors if Fraction(*f) >= ratio),
+        key=lambda f: Fraction(*f),
+        default=(1, 1),
+    )
+
 
+def _turbo_jpeg_thumbnail(image_file_name: Path, size) -> Optional[Image.Image]:
+    """Decodes a JPEG at reduced scale with TurboJPEG, None if it can't."""
+    if _turbo_jpeg is None:
+        return None
+    with open(image_file_name, "rb") as f:
+        data = f.read()
+    try:
+        width, height, _, _ = _turbo_jpeg.decode_header(data)
+        pixels = _turbo_jpeg.decode(
+            data,
+            pixel_format=TJPF_RGB,
+            scaling_factor=_nearest_scaling_for(width, height, size),
+        )
+    except (OSError, ValueError):
+        # Eg. CMYK JPEGs, let Pillow deal with them.
+        return None
+    return Image.fromarray(pixels)
+
+
+def _parse_and_thumbnail(
+    image_file_name: Path, thumbnail_file_name: Path, size
+) -> StatusData:
+    image_meta = {}
+    thumbnail_meta = {}
+    with Image.open(image_file_name) as img:
+        image_meta["format"] = img.format
+        image_meta["width"] = img.size[0]
+        image_meta["height"] = img.size[1]
+        thumb = None
+        if img.format == "JPEG":
+            thumb = _turbo_jpeg_thumbnail(image_file_name, size)
+            if thumb is None:
+                # Let libjpeg decode at a reduced scale (still at least the thumbnail
+                # size), which is much faster than decoding the full image.
+                img.draft("RGB", size)
+        if thumb is None:
+            thumb = img
+        thumb.thumbnail(size)
+        thumb.save(thumbnail_file_name, "WEBP")
+        thumbnail_meta["format"] = "WEBP"
+        thumbnail_meta["width"] = thumb.size[0]
+        thumbnail_meta["height"] = thumb.size[1]
+    # Same shape as the outputs of parse_image and thumbnail.
+    return {"parse_image": image_meta, "thumbnail": thumbnail_meta}
+
+
+def _hash_local_file(file_name: str) -> StatusData:
+    response_meta = {}
+    response_meta["size"] = os.path.getsize(file_name)
+    h = new_hasher()
+    # Empty files cannot be mmapped.
+    if response_meta["size"] > 0:
+        with open(file_name, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+    response_meta["content"] = h.hexdigest()
     return response_meta
 
 
+@taskify
+async def parse_image(context: Context, key: str, status: StatusData) -> StatusData:
+    image_file_name = context.dir / f"{key}.scrape"
+    return await asyncio.to_thread(_parse_image, image_file_name)
+
+
+@taskify
+async def thumbnail(context: Context, key: str, status: StatusData) -> StatusData:
+    image_file_name = context.dir / f"{key}.scrape"
+    return await asyncio.to_thread(
+        _thumbnail,
+        image_file_name,
+        context.dir / f"{key}.thumb.webp",
+        context.params["thumbnail"],
+    )
+
+
+@taskify
+async def parse_and_thumbnail(
+    context: Context, key: str, status: StatusData
+) -> StatusData:
+    """parse_image and thumbnail in one go, decoding the image only once."""
+    image_file_name = context.dir / f"{key}.scrape"
+    return await asyncio.to_thread(
+        _parse_and_thumbnail,
+        image_file_name,
+        context.dir / f"{key}.thumb.webp",
+        context.params["thumbnail"],
+    )
+
+
 def extract_images(row):
     if pd.isna(row["upload"]):
         return []
+    fused_meta = row.get("parse_and_thumbnail")
+    if isinstance(fused_meta, dict):
+        image_meta = fused_meta["parse_image"]
+        thumbnail_meta = fused_meta["thumbnail"]
+    else:
+        image_meta = row["parse_image"]
+        thumbnail_meta = row["thumbnail"]
     return [
         {
             "url": row["upload"]["thumbnail"],
-            "width": row["thumbnail"]["width"],
-            "height": row["thumbnail"]["height"],
+            "width": thumbnail_meta["width"],
+            "height": thumbnail_meta["height"],
             "type": "thumbnail",
         },
         {
             "url": row["upload"]["url"],
-            "width": row["parse_image"]["width"],
-            "height": row["parse_image"]["height"],
+            "width": image_meta["width"],
+            "height": image_meta["height"],
             "type": "full",
         },
     ]
 
 
-def read_images(store_dir: str) -> pd.Series:
+def read_images(store_dir: Path) -> pd.Series:
     """Extends the camp data with hostedImages."""
-    df_metadata = read_metadata(store_dir)
+    df_metadata = read_status(store_dir)
     df_metadata["url"] = df_metadata["params"].map(lambda p: p["url"])
     return df_metadata.set_index("url").apply(extract_images, axis=1)
 
 
-def symlink_force(target, link_name):
-    try:
-        os.symlink(target, link_name)
-    except OSError as e:
-        if e.errno == errno.EEXIST:
-            os.remove(link_name)
-            os.symlink(target, link_name)
-        else:
-            raise e
-
-
 @scrapify
-def scrape_web(context: Context, meta: MetaData) -> ScraperResponse:
-    url = meta["params"]["url"]
-    name = meta["name"]
-    return url, f"{context.dir}/{name}.scrape"
+def scrape_web(context: Context, key: str, status: StatusData) -> ScraperResponse:
+    url = status["params"]["url"]
+    return url, context.dir / f"{key}.scrape"
 
 
 @taskify
 async def scrape_local_file_or_url(
     context: Context,
-    meta: MetaData,
-) -> MetaData:
-    url = meta["params"]["url"]
+    key: str,
+    status: StatusData,
+) -> StatusData:
+    url = status["params"]["url"]
     if not url.startswith("file://"):
-        return await scrape_web(context, meta)
+        return await scrape_web(context, key, status)
     file_name = url.removeprefix("file://")
-    name = meta["name"]
 
-    response_meta = {}
-    response_meta["size"] = os.path.getsize(file_name)
-    with open(file_name, "rb") as f:
-        response_meta["content"] = hashlib.md5(f.read()).hexdigest()
-    symlink_force(file_name, f"{context.dir}/{name}.scrape")
+    response_meta = await asyncio.to_thread(_hash_local_file, file_name)
+    symlink_force(file_name, context.dir / f"{key}.scrape")
 
     return response_meta
@@ -0,0 +1,134 @@
+"""Content addressed memoization of executor outputs.
+
+Two executions are considered equivalent when they run the same executor (node
+interface) on the same params and context params (eg. the cookies of the scrapers) and
+all the upstream executor outputs hash the same. In
+that case the cached output (and files) from the memo directory is reused instead of
+running the executor again, even if the task key is different.
+
+Only executors reporting the files they write are memoized: the wrapped function needs a
+`memo_files(context, key, status) -> list[Path]` attribute, as set by @scrapify.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Iterable, Optional, Sequence
+
+from scrapeflow.status import StatusData
+
+# Suffix of the bookkeeping entries _execute_single_chain_async adds next to the
+# executor outputs in the status.
+_STATUS_SUFFIX = "_status"
+
+
+def _canonical_json(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode(
+        "utf-8"
+    )
+
+
+def output_hash(output: Any) -> str:
+    """Hashes the (json serializable) output of an executor."""
+    return hashlib.blake2b(_canonical_json(output), digest_size=16).hexdigest()
+
+
+def memo_key(
+    executor_name: str,
+    params: Any,
+    context_params: Any,
+    upstream_hashes: Iterable[str],
+) -> str:
+    """Returns the memo key of running executor_name on params after the upstream."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(executor_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(_canonical_json(params))
+    h.update(b"\0")
+    h.update(_canonical_json(context_params))
+    for upstream_hash in upstream_hashes:
+        h.update(b"\0")
+        h.update(upstream_hash.encode("utf-8"))
+    return h.hexdigest()
+
+
+def upstream_hashes(executor_name: str, task_status: StatusData) -> list[str]:
+    """Hashes the outputs of the other executors that already ran for this task."""
+    names = sorted(
+        name
+        for name in task_status
+        if name != executor_name and f"{name}{_STATUS_SUFFIX}" in task_status
+    )
+    return [f"{name}:{output_hash(task_status[name])}" for name in names]
+
+
+def symlink_force(target, link_name):
+    try:
+        os.symlink(target, link_name)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            os.remove(link_name)
+            os.symlink(target, link_name)
+        else:
+            raise e
+
+
+def _memo_file_name(memo_dir: Path, mkey: str, index: int) -> Path:
+    return memo_dir / f"{mkey}.{index}.blob"
+
+
+def _temp_file_name(memo_dir: Path) -> Path:
+    fd, temp_file_name = tempfile.mkstemp(dir=memo_dir, suffix=".tmp")
+    os.close(fd)
+    return Path(temp_file_name)
+
+
+def read_memo(
+    memo_dir: Path, mkey: str, file_names: Sequence[Path]
+) -> Optional[StatusData]:
+    """Returns the memoized output and links its files to file_names, if any."""
+    memo_file_name = memo_dir / f"{mkey}.json"
+    if not memo_file_name.is_file():
+        return None
+    memo = json.loads(memo_file_name.read_text())
+    if memo["num_files"] != len(file_names):
+        return None
+    memo_file_names = [
+        _memo_file_name(memo_dir, mkey, index) for index in range(len(file_names))
+    ]
+    if not all(f.is_file() for f in memo_file_names):
+        return None
+    for memo_file_name, file_name in zip(memo_file_names, file_names):
+        symlink_force(memo_file_name.resolve(), file_name)
+    return memo["output"]
+
+
+def write_memo(
+    memo_dir: Path, mkey: str, output: StatusData, file_names: Sequence[Path]
+) -> None:
+    """Stores the output of an executor and the files it wrote under mkey."""
+    if not all(Path(f).is_file() for f in file_names):
+        # The executor didn't write what it reported, don't memoize it.
+        return
+    memo_dir.mkdir(parents=True, exist_ok=True)
+    # Every file is moved into place atomically, as the memo directory can be shared by
+    # concurrent runs.
+    for index, file_name in enumerate(file_names):
+        temp_file_name = _temp_file_name(memo_dir)
+        temp_file_name.unlink()
+        try:
+            os.link(file_name, temp_file_name)
+        except OSError:
+            # Eg. the memo directory is on a different file system.
+            shutil.copyfile(file_name, temp_file_name)
+        os.replace(temp_file_name, _memo_file_name(memo_dir, mkey, index))
+    # The json is written last, it marks the memo entry complete.
+    temp_file_name = _temp_file_name(memo_dir)
+    temp_file_name.write_text(
+        json.dumps({"num_files": len(file_names), "output": output})
+    )
+    os.replace(temp_file_name, memo_dir / f"{mkey}.json")
@@ -3,26 +3,69 @@
 During init, scrapes the available proxies from proxyscrape.com.
 """
 
+import asyncio
+import random
 from copy import deepcopy
-from random import randint
 from typing import List, Optional
 
 import aiohttp
-import pandas as pd
 import requests
 import tqdm.asyncio
 
+# Cheap endpoint (empty 204 response) to check whether a proxy works.
+_PROXY_CHECK_URL = "https://www.gstatic.com/generate_204"
+_CHECK_PARALLELISM = 500
+_DNS_CACHE_TTL_SECONDS = 300
+
 
 # Base class for ProxyProvider
 class ProxyProvider:
+    bad_proxies: set[str] = set()
+    default_retries = 5
+    # Bumped on every change of proxies / bad_proxies, the good proxies are cached per
+    # country for the version they were computed at. The class level values are
+    # defaults for subclasses that don't call ProxyProvider.__init__.
+    _version = 0
+    _cache: Optional[dict[Optional[str], tuple[int, list[str]]]] = None
+    _proxies: dict[str, list[str]] = {}
+    _random = random.Random()
+
+    def __init__(self) -> None:
+        # Own state per instance instead of the shared class level defaults.
+        self.proxies = {}
+        self.bad_proxies = set()
+        self._cache = {}
+        # Own generator so that threaded hosts don't contend on the global one.
+        self._random = random.Random()
+
     # Dictionary of proxies from country -> [] list of proxies. If the proxy provider
     # does not specify country information, the country key is "". The list of proxies
     # is fully qualified, ie. contain the protocol (and user/password if necessary.)
-    proxies: dict[str, list[str]] = {}
-    bad_proxies: set[str] = set()
-    default_retries = 5
+    # Assign a new dictionary to change them, edits in place are not noticed.
+    @property
+    def proxies(self) -> dict[str, list[str]]:
+        return self._proxies
+
+    @proxies.setter
+    def proxies(self, proxies: dict[str, list[str]]) -> None:
+        self._proxies = proxies
+        self._version += 1
+
+    def add_bad_proxy(self, proxy: str) -> None:
+        self.bad_proxies.add(proxy)
+        self._version += 1
+
+    def reset_bad_proxies(self) -> None:
+        self.bad_proxies.clear()
+        self._version += 1
 
     def _get_good_proxy_list(self, country: Optional[str] = None) -> List[str]:
+        if self._cache is None:
+            self._cache = {}
+        cached = self._cache.get(country)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
         proxy_list: list[str] = []
         if country is None:
             proxy_list = [
@@ -31,64 +74,88 @@ class ProxyProvider:
         elif country in self.proxies:
             proxy_list = self.proxies[country]
 
-        return list(filter(lambda p: p not in self.bad_proxies, proxy_list))
+        good_proxies = [proxy for proxy in proxy_list if proxy not in self.bad_proxies]
+        self._cache[country] = (self._version, good_proxies)
+        return good_proxies
 
     @staticmethod
-    async def _is_good_proxy(session, proxy) -> tuple[str, bool]:
-        try:
-            async with session.head("https://httpbin.org/ip?json", proxy=proxy) as resp:
-                return proxy, resp.status == 200
-        except Exception:
-            return proxy, False
+    async def _is_good_proxy(session, semaphore, proxy) -> tuple[str, bool]:
+        async with semaphore:
+            try:
+                async with session.head(_PROXY_CHECK_URL, proxy=proxy) as resp:
+                    return proxy, resp.status < 400
+            except Exception:
+                return proxy, False
 
     async def check_proxies(self, timeout=30, retries=5) -> None:
-        timeout = aiohttp.ClientTimeout(total=30)
-        self.bad_proxies.clear()
-        all_proxies = self._get_good_proxy_list()
-        for _ in range(retries):
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                ret = await tqdm.asyncio.tqdm.gather(
-                    *[self._is_good_proxy(session, proxy) for proxy in all_proxies]
-                )
-
-            all_proxies.clear()
-            for proxy, status in ret:
-                if status is False:
-                    self.bad_proxies.add(proxy)
-                else:
-                    all_proxies.append(proxy)
-            print("Num bad proxies so far: ", len(self.bad_proxies))
+        """Marks the proxies bad that fail all the retries."""
+        self.reset_bad_proxies()
+        proxies_to_check = list(self._get_good_proxy_list())
+        semaphore = asyncio.Semaphore(_CHECK_PARALLELISM)
+        # The default connector would cap the checks at 100 parallel connections.
+        connector = aiohttp.TCPConnector(
+            limit=_CHECK_PARALLELISM, ttl_dns_cache=_DNS_CACHE_TTL_SECONDS
+        )
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as session:
+            for _ in range(retries):
+                if not proxies_to_check:
+                    break
+                failed_proxies = []
+                for check in tqdm.asyncio.tqdm.as_completed(
+                    [
+                        self._is_good_proxy(session, semaphore, proxy)
+                        for proxy in proxies_to_check
+                    ]
+                ):
+                    proxy, status = await check
+                    if status is False:
+                        failed_proxies.append(proxy)
+                # Only the failed ones are retried.
+                proxies_to_check = failed_proxies
+                print("Num failed proxies in this round: ", len(proxies_to_check))
+
+        for proxy in proxies_to_check:
+            self.add_bad_proxy(proxy)
+        print("Num bad proxies: ", len(self.bad_proxies))
 
     def get_one_proxy(self, country: Optional[str] = None) -> str | None:
         good_proxies = self._get_good_proxy_list(country=country)
         if len(good_proxies) > 0:
-            return good_proxies[randint(0, len(good_proxies) - 1)]
+            return self._random.choice(good_proxies)
         return None
 
 
 class ProxyProviderFromList(ProxyProvider):
     def __init__(self, proxy_list: list[str]):
-        self.proxies["*"] = deepcopy(proxy_list)
+        super().__init__()
+        self.proxies = {"*": deepcopy(proxy_list)}
 
 
 class ProxyProviderFromDict(ProxyProvider):
     def __init__(self, proxy_dict: dict[str, list[str]]):
+        super().__init__()
         self.proxies = deepcopy(proxy_dict)
 
 
 class ProxyProviderFromProxyscrape(ProxyProvider):
     def __init__(self):
+        super().__init__()
         # Init with language independent list.
         resp = requests.get(
             "https://api.proxyscrape.com/v2/?request=displayproxies"
             + "&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all"
         )
-        self.proxies["*"] = [f"http://{p}" for p in resp.text.strip().split("\r\n")]
+        self.proxies = {"*": [f"http://{p}" for p in resp.text.strip().split("\r\n")]}
         print(self.proxies)
 
 
 class ProxyProviderFromWebshare(ProxyProvider):
     def __init__(self, APIKEY: str):
+        import pandas as pd
+
+        super().__init__()
         response = requests.get(
             "https://proxy.webshare.io/api/proxy/list/",
             headers={"Authorization": f"Token {APIKEY}"},
@@ -112,6 +179,8 @@ class ProxyProviderFromWebshare(ProxyProvider):
 
 class ProxyProviderFromIPRoyal(ProxyProvider):
     def __init__(self, APIKEY: str, order_id: int) -> None:
+        import pandas as pd
+
         super().__init__()
 
         response = requests.get(
@@ -129,4 +198,4 @@ class ProxyProviderFromIPRoyal(ProxyProvider):
             axis=1,
         )
         print(f"Got {df_proxies.shape[0]} proxies from IPRoyal.")
-        self.proxies["*"] = deepcopy(list(df_proxies["proxy_string"].values))
+        self.proxies = {"*": deepcopy(list(df_proxies["proxy_string"].values))}
@@ -1,12 +1,13 @@
 """Scraping module for parallel scrapeflow."""
 
 import functools
-import hashlib
+import re
 from pathlib import Path
-from typing import Any, Callable, List, Sequence, Tuple
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Sequence, Tuple
 
 from scrapeflow.executor import Context, taskify
-from scrapeflow.status import StatusData
+from scrapeflow.status import StatusData, new_hasher
 
 ScraperResponse = Tuple[str, Path]
 Scraper = Callable[[Context, str, StatusData], ScraperResponse]
@@ -20,6 +21,14 @@ _HEADERS = {
     "Accept": "application/json",
 }
 
+_CHUNK_SIZE = 1 << 16
+
+# Shared read-only default for missing params / cookies.
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+# Matches the media subtype in a content-type string, cf. _extract_content_type.
+_CONTENT_TYPE_RE = re.compile(r"(?:[^;]*/)?([^;/]*)")
+
 
 def scrapify(func: Scraper):
     """A decorator turning a function returning a url and a filename into a scraper."""
@@ -28,36 +37,30 @@ def scrapify(func: Scraper):
     async def wrapper(context: Context, key: str, status: StatusData) -> StatusData:
         url, file_name = func(context, key, status)
         response_status = {}
-        cookies = (
-            status["params"]["cookies"]
-            if "params" in status and "cookies" in status["params"]
-            else context.params["cookies"]
-            if "cookies" in context.params
-            else {}
-        )
-
-        assert context.session, "Synchronous scraping: not implemented"
+        # Task params take precedence over the context params.
+        params = status.get("params") or _EMPTY
+        cookies = params.get("cookies", context.params.get("cookies", _EMPTY))
+
+        session = context.session
+        assert session, "Synchronous scraping: not implemented"
         proxy = None
         if context.proxy_provider:
             proxy = context.proxy_provider.get_one_proxy()
 
-        post_payload = None
         # request_context holds the request set up as a get or post request.
-        request_context = None
-        if "params" in status and "post_payload" in status["params"]:
+        if "post_payload" in params:
             # Post request.
-            post_payload = status["params"]["post_payload"]
-            request_context = context.session.post(
+            request_context = session.post(
                 url=url,
                 ssl=False,
                 proxy=proxy,
                 cookies=cookies,
                 headers=_HEADERS,
-                json=post_payload,
+                json=params["post_payload"],
             )
         else:
             # Get request.
-            request_context = context.session.get(
+            request_context = session.get(
                 url=url, ssl=False, proxy=proxy, cookies=cookies
             )
 
@@ -68,14 +71,27 @@ def scrapify(func: Scraper):
                 # TODO(zsolt): any way to pass headers?
                 raise RuntimeError(f"HTTP response {status_code}")
 
-            resp = await response.read()
-            response_status["size"] = len(resp)
-            response_status["content"] = hashlib.md5(resp).hexdigest()
+            # Stream the body to disk so that memory stays bounded by the chunk size.
+            size = 0
+            h = new_hasher()
+            # The file may be a link into the memo directory, don't write through it.
+            Path(file_name).unlink(missing_ok=True)
             with open(file_name, mode="wb") as f:
-                f.write(resp)
+                async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                    size += len(chunk)
+                    h.update(chunk)
+                    f.write(chunk)
+            response_status["size"] = size
+            response_status["content"] = h.hexdigest()
             response_status["response_headers"] = headers
         return response_status
 
+    def memo_files(context: Context, key: str, status: StatusData) -> list[Path]:
+        _, file_name = func(context, key, status)
+        return [Path(file_name)]
+
+    # Reports the file written by the scraper, which makes it memoizable.
+    wrapper.memo_files = memo_files  # type: ignore
     return wrapper
 
 
@@ -122,6 +138,7 @@ def _ordered_unique_list(items: Sequence[Any]) -> List[Any]:
 #     )
 
 
+@functools.lru_cache(maxsize=128)
 def _extract_content_type(ct: str) -> str:
     """Extracts the file type from a HTTP response content-type string."""
     # Like `application/xml; charset=utf-8` -> `xml`.
@@ -141,7 +158,8 @@ def _extract_content_type(ct: str) -> str:
     # - text/html;charset=UTF-8
 
     # Takes the part before the first ; and then the text after /.
-    return ct.split(";")[0].split("/")[-1]
+    m = _CONTENT_TYPE_RE.match(ct)
+    return m.group(1).strip() if m else ""
 
 
 def remove_response_headers(d):
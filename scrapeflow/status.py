@@ -1,56 +1,160 @@
+import asyncio
 import hashlib
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Iterable
+from typing import TYPE_CHECKING, Any, Iterable
 
-import pandas as pd
+# pandas is imported lazily, in the functions using it, as it is slow to import.
+if TYPE_CHECKING:
+    import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 StatusData = dict[str, Any]
 Params = dict[str, Any]
 
+# The hashes are used for identity, not security, so we default to the faster blake2b.
+# SCRAPEFLOW_HASH=xxh3 switches to xxhash when it is installed and SCRAPEFLOW_HASH=md5
+# keeps the keys of directories created by earlier versions.
+_HASH_ALGORITHM = os.environ.get("SCRAPEFLOW_HASH", "blake2b")
+
+_READ_WORKERS = 32
+_STATUS_SUFFIX = ".status.json"
+# Temporary column holding the keys while building the status DF.
+_KEY_COLUMN = "__key__"
+
+
+def _loads(data: bytes) -> Any:
+    if orjson is None:
+        return json.loads(data)
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # Files written by the stdlib may contain NaN, which orjson rejects.
+        return json.loads(data)
+
+
+def _dumps(data: Any) -> bytes:
+    if orjson is None:
+        return json.dumps(data, indent=2).encode("utf-8")
+    try:
+        # Rows of a DataFrame (cf. write_status) may contain numpy scalars.
+        return orjson.dumps(
+            data,
+            option=orjson.OPT_INDENT_2
+            | orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_NON_STR_KEYS,
+        )
+    except orjson.JSONEncodeError:
+        # Values the stdlib accepts but orjson rejects, eg. ints wider than 64 bits.
+        return json.dumps(data, indent=2).encode("utf-8")
+
+
+def _read_status_or_error(directory: Path, key: str) -> StatusData | Exception:
+    try:
+        return read_one_status(directory, key) or {"params": {}}
+    except Exception as e:
+        return e
 
-def _read_status_from(directory: Path, keys: Iterable[str]) -> pd.DataFrame:
+
+def _read_status_from(directory: Path, keys: Iterable[str]) -> "pd.DataFrame":
     """Reads the json metadata from the given files into a DF."""
-    status_map = {}
-    for key in keys:
-        try:
-            status_data = read_one_status(directory, key)
-            status_map[key] = status_data or {"params": {}}
-        except Exception as e:
-            print(key)
-            raise e
-    return pd.DataFrame.from_dict(status_map, orient="index")
+    import pandas as pd
+
+    keys = list(keys)
+    # Reading is dominated by the open / read syscalls, so read in parallel.
+    with ThreadPoolExecutor(max_workers=_READ_WORKERS) as executor:
+        statuses = list(
+            executor.map(lambda key: _read_status_or_error(directory, key), keys)
+        )
+    errors = [
+        (key, status)
+        for key, status in zip(keys, statuses)
+        if isinstance(status, Exception)
+    ]
+    if errors:
+        print("Failed to read the status of:", [key for key, _ in errors])
+        raise errors[0][1]
+    if not statuses:
+        return pd.DataFrame()
+    for key, status in zip(keys, statuses):
+        status[_KEY_COLUMN] = key
+    df = pd.DataFrame.from_records(statuses, index=_KEY_COLUMN)
+    df.index.name = None
+    return df
+
+
+def new_hasher():
+    """Returns a hasher with a 128 bit (32 hex characters) digest."""
+    if _HASH_ALGORITHM == "xxh3" and xxhash is not None:
+        return xxhash.xxh3_128()
+    if _HASH_ALGORITHM == "md5":
+        return hashlib.md5()
+    return hashlib.blake2b(digest_size=16)
 
 
 def url_to_key(url: str) -> str:
-    return hashlib.md5(url.encode("utf-8")).hexdigest()
+    h = new_hasher()
+    h.update(url.encode("utf-8"))
+    return h.hexdigest()
 
 
 def read_one_status(directory: Path, key: str) -> StatusData | None:
-    status_file_name = directory / f"{key}.status.json"
+    status_file_name = directory / f"{key}{_STATUS_SUFFIX}"
     if not status_file_name.is_file():
         return None
-    return json.loads(status_file_name.read_text())
+    return _loads(status_file_name.read_bytes())
+
+
+async def read_one_status_async(directory: Path, key: str) -> StatusData | None:
+    """Like read_one_status but reads the file in a thread to not block the loop."""
+    return await asyncio.to_thread(read_one_status, directory, key)
+
+
+def dumps_status(status: StatusData) -> bytes:
+    """Serializes status as written by write_one_status."""
+    return _dumps(status)
+
+
+def write_one_status_bytes(directory: Path, key: str, data: bytes) -> None:
+    """Writes a status already serialized with dumps_status."""
+    status_file_name = directory / f"{key}{_STATUS_SUFFIX}"
+    status_file_name.write_bytes(data)
 
 
 def write_one_status(directory: Path, key: str, status: StatusData) -> None:
-    status_file_name = directory / f"{key}.status.json"
     # Convert meta to string before opening the file to avoid overwriting in case of an
     # error during dumps.
-    status_file_name.write_text(json.dumps(status, indent=2))
+    write_one_status_bytes(directory, key, dumps_status(status))
 
 
-def read_status(directory: Path) -> pd.DataFrame:
+def read_status(directory: Path) -> "pd.DataFrame":
     """Read metadata for all the blobs in the given directory."""
-    keys = (
-        str(x.name).removesuffix(".status.json")
-        for x in directory.glob("*.status.json")
-    )
+    # A missing directory has no statuses, like an empty one.
+    if not os.path.isdir(directory):
+        return _read_status_from(directory, [])
+    # scandir avoids creating a Path object for every file in the directory.
+    with os.scandir(directory) as entries:
+        keys = [
+            entry.name.removesuffix(_STATUS_SUFFIX)
+            for entry in entries
+            if entry.name.endswith(_STATUS_SUFFIX) and entry.is_file()
+        ]
     df = _read_status_from(directory, keys)
     return df
 
 
-def write_status(directory: Path, df_status: pd.DataFrame):
+def write_status(directory: Path, df_status: "pd.DataFrame"):
     """Write the rows of df_status to individual .status.json files."""
     for key, row in df_status.iterrows():
         assert isinstance(key, str), key
@@ -62,21 +166,20 @@ def urls_to_tasks(urls: list[str]) -> dict[str, Params]:
     return {url_to_key(u): {"url": u} for u in urls}
 
 
-def status_summary(directory: Path) -> pd.DataFrame:
+def status_summary(directory: Path) -> "pd.DataFrame":
     df_status = read_status(directory)
     if df_status.empty:
         return df_status
-    df_status = (
-        pd.concat(
-            [
-                df_status[x].value_counts().to_frame()
-                for x in list(df_status)
-                if x.endswith("_status")  # type: ignore
-            ]
-        )
-        .reset_index(names=["index"])
-        .groupby("index")
-        .sum()
+    status_columns = [x for x in list(df_status) if x.endswith("_status")]  # type: ignore
+    if not status_columns:
+        return df_status.iloc[:0]
+    # Count the (executor, status message) pairs in one pass, one column per executor.
+    df_summary = (
+        df_status[status_columns]
+        .melt(var_name="executor", value_name="status")
+        .dropna()
+        .value_counts()
+        .unstack("executor", fill_value=0)
         .astype(int)
     )
-    return df_status.loc[df_status.sum(axis=1).sort_values(ascending=False).index]
+    return df_summary.loc[df_summary.sum(axis=1).sort_values(ascending=False).index]